@@ -37,6 +37,9 @@ arithmetic_rules = [
     when('*', _, 2).then(lambda x: ('+', x, x)),     # x * 2 = x + x
 ]
 
+# Wrap each rule for bottom-up traversal once, not per expression
+compiled_rules = tuple(bottom_up(r) for r in arithmetic_rules)
+
 # Test cases
 test_expressions = [
     # Basic simplifications
@@ -64,7 +67,7 @@ test_expressions = [
 print("\nSimplifying expressions:\n")
 
 for expr in test_expressions:
-    result = rewrite(expr, *[bottom_up(r) for r in arithmetic_rules])
+    result = rewrite(expr, *compiled_rules)
     print(f"{str(expr):30} => {result}")
 
 # More complex example
@@ -78,7 +81,7 @@ complex_expr = ('*',
         ('+', 3, 7)))
 
 print(f"Original: {complex_expr}")
-result = rewrite(complex_expr, *[bottom_up(r) for r in arithmetic_rules])
+result = rewrite(complex_expr, *compiled_rules)
 print(f"Simplified: {result}")
 
 print("\n" + "=" * 50)
@@ -53,6 +53,8 @@ boolean_rules = [
     when('and', '$x', ('or', '$x', _)).then(lambda x, y: x),   # x ∧ (x ∨ y) = x
 ]
 
+compiled_rules = tuple(bottom_up(r) for r in boolean_rules)
+
 # Test cases
 test_cases = [
     # Basic tests
@@ -78,7 +80,7 @@ test_cases = [
 print("\nSimplifying boolean expressions:\n")
 
 for name, expr in test_cases:
-    result = rewrite(expr, *[bottom_up(r) for r in boolean_rules])
+    result = rewrite(expr, *compiled_rules)
     print(f"{name:15} {expr} => {result}")
 
 # More complex example
@@ -97,14 +99,29 @@ print("1. ¬¬(a ∨ b) => (a ∨ b)")
 print("2. The whole expression becomes: (¬a ∨ b) ∧ (a ∨ ¬b) ∧ (a ∨ b)")
 print("3. Further simplification possible with distribution...")
 
-result = rewrite(complex_expr, *[bottom_up(r) for r in boolean_rules])
+result = rewrite(complex_expr, *compiled_rules)
 print(f"\nResult: {result}")
 
 # Example showing depth reduction
 def tree_depth(tree):
-    if not isinstance(tree, tuple):
-        return 0
-    return 1 + max([tree_depth(child) for child in tree[1:]], default=0)
+    # Explicit stack instead of recursion, so deep trees can't hit the limit.
+    # Depths are memoized on node identity, so a subtree shared by several
+    # parents (common after rewriting) is only walked once.
+    depths = {}
+    stack = [tree]
+    while stack:
+        t = stack[-1]
+        if not isinstance(t, tuple) or id(t) in depths:
+            stack.pop()
+            continue
+        pending = [c for c in t[1:] if isinstance(c, tuple) and id(c) not in depths]
+        if pending:
+            stack.extend(pending)
+            continue
+        stack.pop()
+        depths[id(t)] = 1 + max(
+            (depths[id(c)] for c in t[1:] if isinstance(c, tuple)), default=0)
+    return depths.get(id(tree), 0)
 
 print("\n" + "=" * 50)
 print("Depth reduction examples:\n")
@@ -116,7 +133,7 @@ depth_examples = [
 ]
 
 for expr in depth_examples:
-    result = rewrite(expr, *[bottom_up(r) for r in boolean_rules])
+    result = rewrite(expr, *compiled_rules)
     print(f"Depth {tree_depth(expr)} => {tree_depth(result)}: {expr} => {result}")
 
 print("\n" + "=" * 50)
@@ -9,35 +9,83 @@ This showcases the power of mixing symbolic manipulation with Python computation
 import sys
 sys.path.insert(0, '../src')
 
-from tree_rewriter import rewrite, when, _, bottom_up
+from tree_rewriter import rewrite, when, _, bottom_up, dispatch
+import ast
 import math
+import operator
 
 print("Advanced Differentiation: Symbolic + Numerical")
 print("=" * 50)
 
+# Variables of each subexpression, computed once per distinct subtree.
+# Keyed by id(): hashing a tuple key would rehash the whole subtree on every
+# lookup. Each entry holds its tree, so the id cannot be reused meanwhile.
+_FV_CACHE = {}
+
+def free_vars(expr):
+    """Returns the set of symbols appearing in expr (operator heads excluded)"""
+    if isinstance(expr, str):
+        return frozenset((expr,))
+    if not isinstance(expr, tuple):
+        return frozenset()
+    # Post-order on an explicit stack, so deep expressions cannot exceed the
+    # recursion limit: a node is done once all its subexpressions are cached
+    stack = [expr]
+    while stack:
+        node = stack[-1]
+        if id(node) in _FV_CACHE:
+            stack.pop()
+            continue
+        subs = [sub for sub in node[1:] if isinstance(sub, tuple)]
+        pending = [sub for sub in subs if id(sub) not in _FV_CACHE]
+        if pending:
+            stack.extend(pending)
+            continue
+        stack.pop()
+        variables = frozenset(sub for sub in node[1:] if isinstance(sub, str))
+        variables = variables.union(*(_FV_CACHE[id(sub)][1] for sub in subs))
+        _FV_CACHE[id(node)] = (node, variables)
+    return _FV_CACHE[id(expr)][1]
+
 # Helper to check if something is constant with respect to variable
 def is_const_wrt(var):
     """Returns predicate that checks if expression is constant w.r.t. var"""
-    def check(expr):
-        if expr == var:
-            return False
-        if isinstance(expr, (int, float)):
-            return True
-        if isinstance(expr, str) and expr != var:
-            return True
-        if isinstance(expr, tuple):
-            # Recursively check all subexpressions
-            return all(check(sub) for sub in expr[1:])
-        return True
-    return check
-
-# Helper to create numerical derivative function
-def numerical_derivative(f, h=1e-7):
-    """Returns a function that computes f'(x) numerically using central differences."""
+    return lambda expr: var not in free_vars(expr)
+
+# Helper to create numerical derivative function: only needed for opaque
+# Python functions; expressions are differentiated by derivative_function()
+def numerical_derivative(f, h=1e-5):
+    """Returns a function that computes f'(x) numerically.
+
+    Richardson extrapolation of the central differences at h and h/2 cancels
+    their h² error terms where f is smooth over [x - h, x + h]. h stays small
+    so the stencil only straddles a kink for points within h of it.
+    """
+    def central(x, step):
+        return (f(x + step) - f(x - step)) / (2 * step)
     def df(x):
-        return (f(x + h) - f(x - h)) / (2 * h)
+        return (4 * central(x, h / 2) - central(x, h)) / 3
     return df
 
+# Operator implementations shared by eval_expr and the compiled forms
+def _pow(base, exp):
+    return 1 if base == 0 and exp == 0 else base ** exp  # 0^0 = 1 convention
+
+def _ln(arg):
+    if arg <= 0:
+        raise ValueError(f"ln of non-positive number: {arg}")
+    return math.log(arg)
+
+def _sign(val):
+    return 1 if val > 0 else (-1 if val < 0 else 0)
+
+BINARY_OPS = {'+': operator.add, '-': operator.sub, '*': operator.mul,
+              '/': operator.truediv, '^': _pow}
+UNARY_OPS = {'sin': math.sin, 'cos': math.cos, 'exp': math.exp, 'ln': _ln,
+             'abs': abs, 'gamma': math.gamma, 'erf': math.erf,
+             'sqrt': math.sqrt, 'sign': _sign}
+CONSTANTS = {'pi': math.pi, 'e': math.e}
+
 # Helper to evaluate expression at given x value
 def eval_expr(expr, x_val):
     """Evaluate expression at given x value."""
@@ -47,63 +95,198 @@ def eval_expr(expr, x_val):
         return x_val
     elif isinstance(expr, str):
         # Other variables/constants
-        if expr == 'pi':
-            return math.pi
-        elif expr == 'e':
-            return math.e
-        else:
-            raise ValueError(f"Unknown variable: {expr}")
+        if expr in CONSTANTS:
+            return CONSTANTS[expr]
+        raise ValueError(f"Unknown variable: {expr}")
     elif isinstance(expr, tuple):
         op = expr[0]
-        if op == '+':
-            return eval_expr(expr[1], x_val) + eval_expr(expr[2], x_val)
-        elif op == '-':
-            if len(expr) == 2:
-                return -eval_expr(expr[1], x_val)
-            else:
-                return eval_expr(expr[1], x_val) - eval_expr(expr[2], x_val)
-        elif op == '*':
-            return eval_expr(expr[1], x_val) * eval_expr(expr[2], x_val)
-        elif op == '/':
-            return eval_expr(expr[1], x_val) / eval_expr(expr[2], x_val)
-        elif op == '^':
-            base = eval_expr(expr[1], x_val)
-            exp = eval_expr(expr[2], x_val)
-            # Handle special cases like 0^0
-            if base == 0 and exp == 0:
-                return 1  # Convention
-            return base ** exp
-        elif op == 'sin':
-            return math.sin(eval_expr(expr[1], x_val))
-        elif op == 'cos':
-            return math.cos(eval_expr(expr[1], x_val))
-        elif op == 'exp':
-            return math.exp(eval_expr(expr[1], x_val))
-        elif op == 'ln':
-            arg = eval_expr(expr[1], x_val)
-            if arg <= 0:
-                raise ValueError(f"ln of non-positive number: {arg}")
-            return math.log(arg)
-        elif op == 'abs':
-            return abs(eval_expr(expr[1], x_val))
-        elif op == 'gamma':
-            return math.gamma(eval_expr(expr[1], x_val))
-        elif op == 'erf':
-            return math.erf(eval_expr(expr[1], x_val))
-        elif op == 'sqrt':
-            return math.sqrt(eval_expr(expr[1], x_val))
-        elif op == 'sign':
-            val = eval_expr(expr[1], x_val)
-            return 1 if val > 0 else (-1 if val < 0 else 0)
-        elif op == 'integral':
-            # For demo, just return 0 (would need numerical integration in practice)
-            return 0.0
-        else:
-            # For unknown operations, return 0
-            return 0.0
+        if op == '-' and len(expr) == 2:
+            return -eval_expr(expr[1], x_val)
+        # One dict lookup per node instead of a chain of string compares
+        binary = BINARY_OPS.get(op)
+        if binary is not None:
+            return binary(eval_expr(expr[1], x_val), eval_expr(expr[2], x_val))
+        unary = UNARY_OPS.get(op)
+        if unary is not None:
+            return unary(eval_expr(expr[1], x_val))
+        # integral (would need numerical integration in practice) and unknown
+        # operations evaluate to 0 for the demo
+        return 0.0
     else:
         raise ValueError(f"Cannot evaluate: {expr}")
 
+# Compiled evaluation: numerical derivatives call f(x) over and over, so each
+# expression is lowered once to a flat postfix program and then compiled to
+# a Python function instead of re-walking the tree with eval_expr per call.
+
+# Opcodes
+PUSH, LOAD_X, CALL1, CALL2 = range(4)
+
+def compile_tape(expr, unary, binary):
+    """Lower an expression to a list of (opcode, argument) instructions."""
+    tape = []
+
+    def emit(e):
+        if isinstance(e, (int, float)):
+            tape.append((PUSH, e))
+        elif e == 'x':
+            tape.append((LOAD_X, None))
+        elif isinstance(e, str):
+            if e not in CONSTANTS:
+                raise ValueError(f"Unknown variable: {e}")
+            tape.append((PUSH, CONSTANTS[e]))
+        elif isinstance(e, tuple):
+            op = e[0]
+            if op == '-' and len(e) == 2:
+                emit(e[1])
+                tape.append((CALL1, operator.neg))
+            elif op in binary:
+                emit(e[1])
+                emit(e[2])
+                tape.append((CALL2, binary[op]))
+            elif op in unary:
+                emit(e[1])
+                tape.append((CALL1, unary[op]))
+            else:
+                # integral and unknown operations evaluate to 0, as in eval_expr
+                tape.append((PUSH, 0.0))
+        else:
+            raise ValueError(f"Cannot evaluate: {e}")
+
+    emit(expr)
+    return tape
+
+# Operators that become plain Python arithmetic in generated code
+INLINE_BINARY = {operator.add: ast.Add, operator.sub: ast.Sub,
+                 operator.mul: ast.Mult, operator.truediv: ast.Div}
+
+def compile_expr(expr, unary, binary):
+    """Compile an expression into a Python function of x, once.
+
+    The postfix tape is replayed over a stack of AST nodes, giving a single
+    lambda such as `lambda x: sin(x) + gamma(x)` with no per-call dispatch.
+    unary and binary give the operator functions, e.g. DUAL_UNARY and
+    DUAL_BINARY to evaluate on dual numbers.
+    """
+    namespace = {}
+    names = {}
+    stack = []
+    for opcode, arg in compile_tape(expr, unary, binary):
+        if opcode == PUSH:
+            stack.append(ast.Constant(arg))
+        elif opcode == LOAD_X:
+            stack.append(ast.Name('x', ast.Load()))
+        elif arg is operator.neg:
+            stack.append(ast.UnaryOp(ast.USub(), stack.pop()))
+        elif opcode == CALL2 and arg in INLINE_BINARY:
+            right = stack.pop()
+            stack.append(ast.BinOp(stack.pop(), INLINE_BINARY[arg](), right))
+        else:
+            if arg not in names:
+                names[arg] = f"_f{len(names)}"
+                namespace[names[arg]] = arg
+            args = [stack.pop()]
+            if opcode == CALL2:
+                args.insert(0, stack.pop())
+            stack.append(ast.Call(ast.Name(names[arg], ast.Load()), args, []))
+    params = ast.arguments(posonlyargs=[], args=[ast.arg('x')], kwonlyargs=[],
+                           kw_defaults=[], defaults=[])
+    tree = ast.fix_missing_locations(ast.Expression(ast.Lambda(params, stack[0])))
+    return eval(compile(tree, '<expr>', 'eval'), namespace)
+
+# Forward-mode automatic differentiation: evaluating a compiled expression
+# on dual numbers yields f(x) and the exact f'(x) in the same single pass,
+# instead of two evaluations and an O(h) error from central differences.
+
+class Dual:
+    """A value v paired with its derivative d."""
+    __slots__ = ('v', 'd')
+
+    def __init__(self, v, d=0.0):
+        self.v = v
+        self.d = d
+
+    @staticmethod
+    def lift(value):
+        return value if isinstance(value, Dual) else Dual(value)
+
+    def __add__(self, other):
+        other = Dual.lift(other)
+        return Dual(self.v + other.v, self.d + other.d)
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        other = Dual.lift(other)
+        return Dual(self.v - other.v, self.d - other.d)
+
+    def __rsub__(self, other):
+        return Dual.lift(other) - self
+
+    def __mul__(self, other):
+        other = Dual.lift(other)
+        return Dual(self.v * other.v, self.d * other.v + self.v * other.d)
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, other):
+        other = Dual.lift(other)
+        return Dual(self.v / other.v,
+                    (self.d * other.v - self.v * other.d) / (other.v * other.v))
+
+    def __rtruediv__(self, other):
+        return Dual.lift(other) / self
+
+    def __neg__(self):
+        return Dual(-self.v, -self.d)
+
+def digamma(x):
+    """ψ(x) = Γ'(x)/Γ(x), by recurrence up to x ≥ 6 then the asymptotic series."""
+    result = 0.0
+    while x < 6:
+        result -= 1 / x
+        x += 1
+    inv2 = 1 / (x * x)
+    return result + math.log(x) - 0.5 / x - inv2 * (
+        1/12 - inv2 * (1/120 - inv2 * (1/252 - inv2 * (1/240 - inv2 / 132))))
+
+def _chain(f, df):
+    """Lift f to dual numbers given its derivative df (the chain rule)."""
+    def lifted(u):
+        u = Dual.lift(u)
+        return Dual(f(u.v), df(u.v) * u.d)
+    return lifted
+
+def _dual_pow(base, exp):
+    base, exp = Dual.lift(base), Dual.lift(exp)
+    value = _pow(base.v, exp.v)
+    d = 0.0
+    if base.d:
+        d += exp.v * _pow(base.v, exp.v - 1) * base.d
+    if exp.d:
+        d += value * math.log(base.v) * exp.d
+    return Dual(value, d)
+
+DUAL_BINARY = {**BINARY_OPS, '^': _dual_pow}
+DUAL_UNARY = {
+    'sin': _chain(math.sin, math.cos),
+    'cos': _chain(math.cos, lambda v: -math.sin(v)),
+    'exp': _chain(math.exp, math.exp),
+    'ln': _chain(_ln, lambda v: 1 / v),
+    'abs': _chain(abs, _sign),  # sign-only subgradient, 0 at the kink
+    'gamma': _chain(math.gamma, lambda v: math.gamma(v) * digamma(v)),
+    'erf': _chain(math.erf, lambda v: 2 / math.sqrt(math.pi) * math.exp(-v * v)),
+    'sqrt': _chain(math.sqrt, lambda v: 0.5 / math.sqrt(v)),
+    'sign': _chain(_sign, lambda v: 0),
+}
+
+def derivative_function(expr):
+    """Returns a function computing d(expr)/dx at a point by forward-mode AD."""
+    f = compile_expr(expr, DUAL_UNARY, DUAL_BINARY)
+    def df(x):
+        return Dual.lift(f(Dual(x, 1.0))).d
+    return df
+
 # Extended differentiation rules including special cases
 diff_rules = [
     # === Standard rules (as before) ===
@@ -171,13 +354,9 @@ diff_rules = [
 def resolve_numerical(expr):
     """Convert ('numerical_derivative', expr) nodes to actual Python functions."""
     if isinstance(expr, tuple) and expr[0] == 'numerical_derivative':
-        # Create a function that numerically differentiates the expression
+        # Differentiate the expression numerically, exactly, via dual numbers
         inner_expr = expr[1]
-        
-        def f(x):
-            return eval_expr(inner_expr, x)
-        
-        df = numerical_derivative(f)
+        df = derivative_function(inner_expr)
         
         # Return a special node that represents this function
         return ('function', df, f"d/dx[{inner_expr}]")
@@ -216,10 +395,12 @@ print("\nDifferentiating expressions:\n")
 
 all_rules = diff_rules
 
+compiled_rules = (bottom_up(dispatch(*all_rules)),)
+
 for name, expr in test_cases:
     # Compute derivative
     deriv_expr = ('d', expr, 'x')
-    result = rewrite(deriv_expr, *[bottom_up(r) for r in all_rules])
+    result = rewrite(deriv_expr, *compiled_rules)
     result = resolve_numerical(result)
     
     if isinstance(result, tuple) and result[0] == 'function':
@@ -264,7 +445,7 @@ mixed_expr = ('+', ('sin', 'x'), ('gamma', 'x'))
 print(f"f(x) = {mixed_expr}")
 
 deriv_expr = ('d', mixed_expr, 'x')
-result = rewrite(deriv_expr, *[bottom_up(r) for r in all_rules])
+result = rewrite(deriv_expr, *compiled_rules)
 result = resolve_numerical(result)
 
 print(f"f'(x) = {result}")
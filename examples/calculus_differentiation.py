@@ -8,26 +8,76 @@ Complete implementation of differentiation rules using tree rewriting.
 import sys
 sys.path.insert(0, '../src')
 
-from tree_rewriter import rewrite, when, _, bottom_up, is_literal
+from tree_rewriter import rewrite, when, _, bottom_up, is_literal, dispatch, innermost
 
 print("Symbolic Differentiation")
 print("=" * 50)
 
+# Variables of each subexpression, computed once per distinct subtree.
+# Keyed by id(): hashing a tuple key would rehash the whole subtree on every
+# lookup. Each entry holds its tree, so the id cannot be reused meanwhile.
+_FV_CACHE = {}
+
+def free_vars(expr):
+    """Returns the set of symbols appearing in expr (operator heads excluded)"""
+    if isinstance(expr, str):
+        return frozenset((expr,))
+    if not isinstance(expr, tuple):
+        return frozenset()
+    # Post-order on an explicit stack, so deep expressions cannot exceed the
+    # recursion limit: a node is done once all its subexpressions are cached
+    stack = [expr]
+    while stack:
+        node = stack[-1]
+        if id(node) in _FV_CACHE:
+            stack.pop()
+            continue
+        subs = [sub for sub in node[1:] if isinstance(sub, tuple)]
+        pending = [sub for sub in subs if id(sub) not in _FV_CACHE]
+        if pending:
+            stack.extend(pending)
+            continue
+        stack.pop()
+        variables = frozenset(sub for sub in node[1:] if isinstance(sub, str))
+        variables = variables.union(*(_FV_CACHE[id(sub)][1] for sub in subs))
+        _FV_CACHE[id(node)] = (node, variables)
+    return _FV_CACHE[id(expr)][1]
+
 # Helper to check if something is constant with respect to variable
 def is_const_wrt(var):
     """Returns predicate that checks if expression is constant w.r.t. var"""
-    def check(expr):
-        if expr == var:
-            return False
-        if isinstance(expr, (int, float)):
-            return True
-        if isinstance(expr, str) and expr != var:
-            return True
-        if isinstance(expr, tuple):
-            # Recursively check all subexpressions
-            return all(check(sub) for sub in expr[1:])
-        return True
-    return check
+    return lambda expr: var not in free_vars(expr)
+
+# Simplification rules to clean up results
+simplify_rules = [
+    # Arithmetic
+    when('+', 0, _).then(lambda x: x),
+    when('+', _, 0).then(lambda x: x),
+    when('*', 0, _).then(0),
+    when('*', _, 0).then(0),
+    when('*', 1, _).then(lambda x: x),
+    when('*', _, 1).then(lambda x: x),
+    when('-', _, 0).then(lambda x: x),
+    when('-', 0, _).then(lambda x: ('-', x)),
+    when('/', _, 1).then(lambda x: x),
+    when('^', _, 0).then(1),
+    when('^', _, 1).then(lambda x: x),
+    
+    # Constant folding
+    when('+', is_literal, is_literal).then(lambda a, b: a + b),
+    when('-', is_literal, is_literal).then(lambda a, b: a - b),
+    when('*', is_literal, is_literal).then(lambda a, b: a * b),
+    when('/', is_literal, is_literal).where(lambda a, b: b != 0).then(lambda a, b: a / b),
+    
+    # Negation
+    when('-', _).then(lambda x: ('*', -1, x)),
+]
+
+# Constant rule outputs are put in simplified form once, when the rules are
+# built, so simplify_rules has nothing left to clean up after they fire
+def canonical(template):
+    """Simplify a constant right-hand side at rule-definition time."""
+    return rewrite(template, *[bottom_up(r) for r in simplify_rules])
 
 # Differentiation rules for d/dx
 # We'll use ('d', expr, var) to represent d(expr)/d(var)
@@ -83,7 +133,7 @@ diff_rules = [
     # === Exponential and Logarithmic ===
     
     # d(e^x)/dx = e^x
-    when('d', ('exp', 'x'), 'x').then(('exp', 'x')),
+    when('d', ('exp', 'x'), 'x').then(canonical(('exp', 'x'))),
     
     # d(e^u)/dx = e^u * du/dx
     when('d', ('exp', _), '$var').then(
@@ -91,7 +141,7 @@ diff_rules = [
     ),
     
     # d(ln(x))/dx = 1/x
-    when('d', ('ln', 'x'), 'x').then(('/', 1, 'x')),
+    when('d', ('ln', 'x'), 'x').then(canonical(('/', 1, 'x'))),
     
     # d(ln(u))/dx = (1/u) * du/dx
     when('d', ('ln', _), '$var').then(
@@ -106,13 +156,13 @@ diff_rules = [
     # === Trigonometric Functions ===
     
     # d(sin(x))/dx = cos(x)
-    when('d', ('sin', 'x'), 'x').then(('cos', 'x')),
+    when('d', ('sin', 'x'), 'x').then(canonical(('cos', 'x'))),
     
     # d(cos(x))/dx = -sin(x)
-    when('d', ('cos', 'x'), 'x').then(('-', 0, ('sin', 'x'))),
+    when('d', ('cos', 'x'), 'x').then(canonical(('-', 0, ('sin', 'x')))),
     
     # d(tan(x))/dx = sec²(x) = 1/cos²(x)
-    when('d', ('tan', 'x'), 'x').then(('/', 1, ('^', ('cos', 'x'), 2))),
+    when('d', ('tan', 'x'), 'x').then(canonical(('/', 1, ('^', ('cos', 'x'), 2)))),
     
     # Chain rule versions for trig
     when('d', ('sin', _), '$var').then(
@@ -131,24 +181,24 @@ diff_rules = [
     
     # d(arcsin(x))/dx = 1/√(1-x²)
     when('d', ('arcsin', 'x'), 'x').then(
-        ('/', 1, ('sqrt', ('-', 1, ('^', 'x', 2))))
+        canonical(('/', 1, ('sqrt', ('-', 1, ('^', 'x', 2)))))
     ),
     
     # d(arccos(x))/dx = -1/√(1-x²)
     when('d', ('arccos', 'x'), 'x').then(
-        ('-', 0, ('/', 1, ('sqrt', ('-', 1, ('^', 'x', 2)))))
+        canonical(('-', 0, ('/', 1, ('sqrt', ('-', 1, ('^', 'x', 2))))))
     ),
     
     # d(arctan(x))/dx = 1/(1+x²)
     when('d', ('arctan', 'x'), 'x').then(
-        ('/', 1, ('+', 1, ('^', 'x', 2)))
+        canonical(('/', 1, ('+', 1, ('^', 'x', 2))))
     ),
     
     # === Special Functions ===
     
     # d(sqrt(x))/dx = 1/(2*sqrt(x))
     when('d', ('sqrt', 'x'), 'x').then(
-        ('/', 1, ('*', 2, ('sqrt', 'x')))
+        canonical(('/', 1, ('*', 2, ('sqrt', 'x'))))
     ),
     
     # d(sqrt(u))/dx = 1/(2*sqrt(u)) * du/dx
@@ -157,32 +207,7 @@ diff_rules = [
     ),
     
     # d(abs(x))/dx = x/abs(x) = sign(x) for x ≠ 0
-    when('d', ('abs', 'x'), 'x').then(('sign', 'x')),
-]
-
-# Simplification rules to clean up results
-simplify_rules = [
-    # Arithmetic
-    when('+', 0, _).then(lambda x: x),
-    when('+', _, 0).then(lambda x: x),
-    when('*', 0, _).then(0),
-    when('*', _, 0).then(0),
-    when('*', 1, _).then(lambda x: x),
-    when('*', _, 1).then(lambda x: x),
-    when('-', _, 0).then(lambda x: x),
-    when('-', 0, _).then(lambda x: ('-', x)),
-    when('/', _, 1).then(lambda x: x),
-    when('^', _, 0).then(1),
-    when('^', _, 1).then(lambda x: x),
-    
-    # Constant folding
-    when('+', is_literal, is_literal).then(lambda a, b: a + b),
-    when('-', is_literal, is_literal).then(lambda a, b: a - b),
-    when('*', is_literal, is_literal).then(lambda a, b: a * b),
-    when('/', is_literal, is_literal).where(lambda a, b: b != 0).then(lambda a, b: a / b),
-    
-    # Negation
-    when('-', _).then(lambda x: ('*', -1, x)),
+    when('d', ('abs', 'x'), 'x').then(canonical(('sign', 'x'))),
 ]
 
 # Test cases from a first-year calculus book
@@ -229,10 +254,14 @@ print("\nDifferentiating expressions (d/dx):\n")
 
 all_rules = diff_rules + simplify_rules
 
+# One sweep to normal form: only rules whose head fits a node are tried,
+# and only rule outputs are revisited
+compiled_rules = (innermost(dispatch(*all_rules)),)
+
 for name, expr in test_cases:
     # Compute derivative
     deriv_expr = ('d', expr, 'x')
-    result = rewrite(deriv_expr, *[bottom_up(r) for r in all_rules])
+    result = rewrite(deriv_expr, *compiled_rules)
     
     print(f"{name:20} {str(expr):30} => {result}")
 
@@ -245,7 +274,7 @@ complex_expr = ('/',
     ('+', ('^', 'x', 2), 1))
 
 print(f"f(x) = {complex_expr}")
-print(f"\nf'(x) = {rewrite(('d', complex_expr, 'x'), *[bottom_up(r) for r in all_rules])}")
+print(f"\nf'(x) = {rewrite(('d', complex_expr, 'x'), *compiled_rules)}")
 
 print("\n" + "=" * 50)
 print("Key insights:")
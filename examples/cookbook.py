@@ -14,7 +14,7 @@ def repeat(rule):
     def r(t):
         while True:
             new = rule(t)
-            if new == t:
+            if new is t or new == t:
                 return t
             t = new
     return r
@@ -23,10 +23,28 @@ def repeat(rule):
 def top_down(rule):
     """Apply rule pre-order (before visiting children), then again after children."""
     def walk(t):
-        t2 = rule(t)
-        if isinstance(t2, tuple):
-            t2 = (t2[0],) + tuple(walk(ch) for ch in t2[1:])
-        return rule(t2)
+        # Explicit stack instead of recursion: (node, children_done) entries,
+        # with finished subtrees collected on `done` in left-to-right order
+        stack = [(t, False)]
+        done = []
+        while stack:
+            node, children_done = stack.pop()
+            if children_done:
+                split = len(done) - (len(node) - 1)
+                children = tuple(done[split:])
+                del done[split:]
+                # Share the node itself when no child changed
+                if any(new is not old for new, old in zip(children, node[1:])):
+                    node = (node[0],) + children
+                done.append(rule(node))
+                continue
+            node = rule(node)
+            if isinstance(node, tuple):
+                stack.append((node, True))
+                stack.extend((ch, False) for ch in reversed(node[1:]))
+            else:
+                done.append(rule(node))
+        return done[0]
     return walk
 
 
@@ -8,22 +8,25 @@ A practical example showing how tree rewriting can optimize CSS.
 import sys
 sys.path.insert(0, '../src')
 
-from tree_rewriter import rewrite, when, bottom_up
+from tree_rewriter import rewrite, when, bottom_up, dispatch
 import re
 
 print("CSS Optimizer")
 print("=" * 50)
 
-# Helper functions
+# Helper functions, with their patterns compiled once at import
+DOUBLED_HEX = re.compile(r'^#([0-9a-f])\1([0-9a-f])\2([0-9a-f])\3$', re.I)
+ZERO_UNIT = re.compile(r'^0(px|em|rem|%)$')
+
 def shorten_hex(color):
     """#RRGGBB -> #RGB if possible"""
-    if match := re.match(r'^#([0-9a-f])\1([0-9a-f])\2([0-9a-f])\3$', color, re.I):
+    if match := DOUBLED_HEX.match(color):
         return f"#{match.group(1)}{match.group(2)}{match.group(3)}"
     return color
 
 def remove_zero_unit(value):
     """0px -> 0"""
-    if re.match(r'^0(px|em|rem|%)$', value):
+    if ZERO_UNIT.match(value):
         return '0'
     return value
 
@@ -53,6 +56,9 @@ css_rules = [
     ),
 ]
 
+# Rules are indexed by head, so 'rule'/'props'/'prop' nodes try none of them
+compiled_rules = (bottom_up(dispatch(*css_rules)),)
+
 # Example CSS structures
 print("\nOptimizing CSS properties:\n")
 
@@ -68,7 +74,7 @@ test_cases = [
 
 for prop_type, value in test_cases:
     expr = (prop_type, value)
-    result = rewrite(expr, *css_rules)
+    result = rewrite(expr, *compiled_rules)
     _ignored, new_value = result
     print(f"{prop_type}: {value:10} => {new_value}")
 
@@ -101,7 +107,7 @@ def print_css(rule):
 print("Original:")
 print_css(css_rule)
 
-optimized = rewrite(css_rule, *[bottom_up(r) for r in css_rules])
+optimized = rewrite(css_rule, *compiled_rules)
 
 print("\nOptimized:")
 print_css(optimized)
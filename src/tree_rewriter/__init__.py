@@ -3,13 +3,13 @@
 __version__ = '0.1.0'
 
 from .tree_rewriter import (
-    rewrite, when, _, bottom_up, commutative,
+    rewrite, when, _, bottom_up, innermost, commutative, intern,
     is_literal, is_type,
-    first, all
+    first, all, memoize, dispatch
 )
 
 __all__ = [
-    'rewrite', 'when', '_', 'bottom_up', 'commutative',
+    'rewrite', 'when', '_', 'bottom_up', 'innermost', 'commutative', 'intern',
     'is_literal', 'is_type',
-    'first', 'all'
+    'first', 'all', 'memoize', 'dispatch'
 ]
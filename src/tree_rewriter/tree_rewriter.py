@@ -9,7 +9,9 @@ Core concepts:
 - Pattern matching uses wildcards (_) and named variables ($x)
 """
 
-from typing import Any, Callable, Dict, Final, List, Optional, Tuple, Union, cast
+import math
+import sys
+from typing import Any, Callable, Dict, Final, List, Optional, Tuple, Union
 
 # === Type Definitions ===
 # Trees are either atomic values or nested tuples (S-expressions)
@@ -38,7 +40,9 @@ def rewrite(tree: Tree, *rules: Rule) -> Tree:
     while True:
         for rule in rules:
             new_tree = rule(tree)
-            if new_tree != tree:
+            # Unchanged trees usually come back as the same object: skip the
+            # structural comparison then. Equal copies still count as no change.
+            if new_tree is not tree and new_tree != tree:
                 tree = new_tree
                 break
         else:
@@ -62,20 +66,139 @@ def bottom_up(rule: Rule) -> Rule:
         A new rule that applies the original rule bottom-up
     """
     def transform(tree: Tree) -> Tree:
-        # First, recursively transform all children
-        if isinstance(tree, tuple) and tree:
-            head = tree[0]
-            children = tuple(transform(child) for child in tree[1:])
-            tree = (head,) + children
-
-        # Then apply the rule to this node
-        return rule(tree)
+        # Post-order walk on an explicit stack, so deep trees cannot exceed
+        # the recursion limit. A node is pushed below a _CHILDREN_DONE marker
+        # and its children; results of finished subtrees collect on `done`.
+        stack: List[Any] = [tree]
+        done: List[Tree] = []
+        while stack:
+            node = stack.pop()
+            if node is _CHILDREN_DONE:
+                node = stack.pop()
+                split = len(done) - (len(node) - 1)
+                children = tuple(done[split:])
+                del done[split:]
+                # Only rebuild if a child changed, so unchanged subtrees keep
+                # their identity (and any cached results keyed on it)
+                if any(new is not old for new, old in zip(children, node[1:])):
+                    node = (node[0],) + children
+                # Then apply the rule to this node
+                done.append(rule(node))
+            elif isinstance(node, tuple) and node:
+                # First transform all children, leftmost on top
+                stack.append(node)
+                stack.append(_CHILDREN_DONE)
+                stack.extend(node[:0:-1])
+            else:
+                done.append(rule(node))
+        return done[0]
 
     return transform
 
 
+# Stack marker used by bottom_up: the node below it has had its children done
+_CHILDREN_DONE: Final[object] = object()
+
+
+# === Hash-Consing ===
+
+# Canonical instance of every tree passed through intern(), keyed by the
+# type-tagged children (see _atom_key) so that 1, 1.0 and True stay distinct
+_interned: Dict[Tuple[Any, ...], Tuple[Any, ...]] = {}
+
+
+def intern(tree: Tree) -> Tree:
+    """Return the canonical shared instance of a tree (hash-consing).
+
+    Structurally equal trees passed through intern() come back as the very
+    same object, so equal subtrees are shared in memory and equality checks
+    (such as a repeated $x in a pattern) short-circuit on identity. String
+    atoms are interned too, so symbols built at runtime (e.g. by a parser)
+    compare against rule literals by pointer.
+
+    The table of canonical trees is module-level and never shrinks: every
+    interned tree is retained for the life of the process.
+
+    Args:
+        tree: The tree to intern
+
+    Returns:
+        A tree equal to the input, shared with all previously interned equal trees
+    """
+    # Post-order walk on an explicit stack, as in bottom_up()
+    stack: List[Any] = [tree]
+    done: List[Tree] = []
+    while stack:
+        node = stack.pop()
+        if node is _CHILDREN_DONE:
+            node = stack.pop()
+            split = len(done) - len(node)
+            children = tuple(done[split:])
+            del done[split:]
+            # Children are canonical already, so tuples are told apart by identity
+            key = tuple(
+                id(child) if type(child) is tuple else _atom_key(child)
+                for child in children
+            )
+            done.append(_interned.setdefault(key, children))
+        elif isinstance(node, tuple):
+            stack.append(node)
+            stack.append(_CHILDREN_DONE)
+            stack.extend(reversed(node))
+        elif type(node) is str:
+            # sys.intern() rejects str subclasses; those atoms are kept as they are
+            done.append(sys.intern(node))
+        else:
+            done.append(node)
+    return done[0]
+
+
+def _atom_key(atom: Any) -> Tuple[Any, ...]:
+    """Key an atom so that only atoms of the same type and sign compare equal.
+
+    Plain equality would let 1, 1.0 and True, or 0.0 and -0.0, share a node.
+    """
+    if type(atom) is float:
+        return (float, atom, math.copysign(1.0, atom))
+    if type(atom) is complex:
+        return (
+            complex, atom,
+            math.copysign(1.0, atom.real), math.copysign(1.0, atom.imag),
+        )
+    return (type(atom), atom)
+
+
 # === Pattern Matching and Rule Construction ===
 
+# Pattern element kinds, classified once when a rule is built so that
+# matching does no isinstance/startswith/callable checks per tree
+_LITERAL, _WILDCARD, _VARIABLE, _BOUND, _PREDICATE, _TUPLE = range(6)
+CompiledPattern = Tuple[int, Any]
+
+
+def _compile_pattern(pattern: Any, slots: List[str]) -> CompiledPattern:
+    """Classify a pattern element as (kind, value), recursing into tuples.
+
+    Matching visits elements left to right, so the position of every binding
+    is known here: slots lists the binding names in that order ('' for
+    anonymous ones), and a repeated $name compiles to a check of its slot.
+    """
+    if callable(pattern) and not isinstance(pattern, type):
+        slots.append("")
+        return (_PREDICATE, pattern)
+    if pattern is _ or pattern == "_":
+        slots.append("")
+        return (_WILDCARD, None)
+    if isinstance(pattern, str) and pattern.startswith("$"):
+        if pattern in slots:
+            return (_BOUND, slots.index(pattern))
+        slots.append(pattern)
+        return (_VARIABLE, None)
+    if isinstance(pattern, tuple):
+        return (_TUPLE, tuple(_compile_pattern(elem, slots) for elem in pattern))
+    return (_LITERAL, pattern)
+
+
 class when:
     """Build transformation rules with a fluent interface.
 
@@ -93,11 +216,30 @@ class when:
         literal : exact match
         callable : predicate function
     """
+    # Fixed attributes: no per-rule __dict__, and faster lookups in __call__
+    __slots__ = (
+        "_compiled", "_constant", "_pattern", "_result",
+        "arity", "guard", "head", "transform",
+    )
+
     def __init__(self, *pattern: Any) -> None:
-        self.pattern: Tuple[Any, ...] = pattern
+        self._pattern: Tuple[Any, ...] = pattern
+        # Head symbol every matching tree must start with, or _ if any can
+        self.head: Any = _head_of(pattern)
+        # Tuple patterns only match trees of the same length
+        self.arity: int = len(pattern)
+        self._compiled: Tuple[CompiledPattern, ...] = _compile_pattern(pattern, [])[1]
         self.guard: Optional[Predicate] = None
         self.transform: Optional[Callable[..., Tree]] = None
+        # Constant results are returned directly, without calling transform
+        self._constant: bool = False
+        self._result: Tree = None
     
+    @property
+    def pattern(self) -> Tuple[Any, ...]:
+        """The pattern this rule matches, compiled once at construction."""
+        return self._pattern
+
     def where(self, predicate: Predicate) -> "when":
         """Add a guard condition that must be satisfied for the rule to apply.
 
@@ -121,8 +263,11 @@ class when:
         """
         if callable(result):
             self.transform = result
+            self._constant = False
         else:
             self.transform = lambda *_: result
+            self._constant = True
+            self._result = result
         return self
     
     def __call__(self, tree: Tree) -> Tree:
@@ -134,80 +279,80 @@ class when:
         Returns:
             Either the transformed tree or the original tree if no match
         """
-        bindings = self._match(self.pattern, tree)
-        if bindings is not None:
+        bindings: List[Tree] = []
+        if self._match(self._compiled, tree, bindings):
             # Pattern matched - check guard condition if present
-            if self.guard is None or self.guard(*bindings.values()):
+            if self.guard is None or self.guard(*bindings):
                 # Guard passed - apply transformation if defined
+                if self._constant:
+                    return self._result
                 if self.transform is not None:
-                    return self.transform(*bindings.values())
+                    return self.transform(*bindings)
 
         # No match, guard failed, or no transformation - return unchanged
         return tree
     
     def _match(
-        self, pattern: Any, tree: Tree, bindings: Optional[Dict[str, Tree]] = None
-    ) -> Optional[Dict[str, Tree]]:
-        """Match pattern against tree, collecting variable bindings.
+        self, pattern: Tuple[CompiledPattern, ...], tree: Tree, bindings: List[Tree]
+    ) -> bool:
+        """Match a compiled tuple pattern against tree, collecting variable bindings.
 
         Args:
-            pattern: The pattern to match (can contain wildcards, variables, literals)
+            pattern: The compiled elements of a tuple pattern (see _compile_pattern)
             tree: The tree to match against
-            bindings: Existing variable bindings (for recursive calls)
+            bindings: Bound values so far, in binding order, appended in place
 
         Returns:
-            Dict of variable bindings if match succeeds, None if it fails
+            True if the match succeeds, False if it fails
         """
-        if bindings is None:
-            bindings = {}
-
-        # Predicate patterns: callable functions that test the tree
-        if callable(pattern) and not isinstance(pattern, type):
-            predicate = cast(Predicate, pattern)
-            if predicate(tree):
-                # Generate anonymous binding for predicate matches
-                binding_name = f"_{len(bindings)}"
-                bindings[binding_name] = tree
-                return bindings
-            return None
-
-        # Wildcard patterns: _ matches anything
-        if pattern is _ or pattern == "_":
-            binding_name = f"_{len(bindings)}"
-            bindings[binding_name] = tree
-            return bindings
-
-        # Named variable patterns: $name must match consistently
-        if isinstance(pattern, str) and pattern.startswith("$"):
-            if pattern in bindings:
-                # Variable already bound - must match the same value
-                return bindings if bindings[pattern] == tree else None
-            else:
-                # First occurrence - bind the variable
-                bindings[pattern] = tree
-                return bindings
-
-        # Literal patterns: exact equality
-        if pattern == tree:
-            return bindings
-
-        # Tuple patterns: recursive matching of structure
-        if isinstance(pattern, tuple) and isinstance(tree, tuple):
-            if len(pattern) != len(tree):
-                return None
-            # All sub-patterns must match
-            for pattern_elem, tree_elem in zip(pattern, tree):
-                if self._match(pattern_elem, tree_elem, bindings) is None:
-                    return None
-            return bindings
-
-        # No match
-        return None
+        # Tuple patterns: same length, and every element must match
+        if not isinstance(tree, tuple) or len(tree) != len(pattern):
+            return False
+        for (kind, value), tree_elem in zip(pattern, tree):
+            if kind == _LITERAL:
+                # Literal patterns: exact equality
+                if value != tree_elem:
+                    return False
+            elif kind == _WILDCARD or kind == _VARIABLE:
+                # Wildcards match anything; a $name binds on first occurrence
+                bindings.append(tree_elem)
+            elif kind == _BOUND:
+                # Named variable seen before - must match the same value
+                bound = bindings[value]
+                # Interned subtrees compare by identity; fall back to equality
+                if not (bound is tree_elem or bound == tree_elem):
+                    return False
+            elif kind == _PREDICATE:
+                # Predicate patterns: bind the tree if the test passes
+                if not value(tree_elem):
+                    return False
+                bindings.append(tree_elem)
+            elif not self._match(value, tree_elem, bindings):
+                return False
+        return True
+
+
+def _head_of(pattern: Tuple[Any, ...]) -> Any:
+    """Return the literal head of a pattern, or _ if it has none."""
+    if not pattern:
+        return _
+    head = pattern[0]
+    if (
+        callable(head)
+        or head is _
+        or head == "_"
+        or isinstance(head, tuple)
+        or (isinstance(head, str) and head.startswith("$"))
+    ):
+        return _
+    return head
 
 
 class Wildcard:
     """Represents a wildcard pattern that matches anything."""
 
+    __slots__ = ()
+
     def __repr__(self) -> str:
         return "_"
 
@@ -220,8 +365,10 @@ _: Final[Wildcard] = Wildcard()
 def commutative(op: Any, value: Any, result: Union[Callable[..., Tree], Tree]) -> List[Rule]:
     """Create rules for commutative binary operations.
 
-    Generates two rules: (op, value, _) and (op, _, value) both producing the same result.
+    Matches both (op, value, _) and (op, _, value), producing the same result.
     This handles the fact that commutative operators like + and * work both ways.
+    The two orders are fused into one rule, so a bottom_up() traversal of it
+    visits the tree once rather than once per order.
 
     Args:
         op: The operator (typically a string like '+' or '*')
@@ -229,12 +376,34 @@ def commutative(op: Any, value: Any, result: Union[Callable[..., Tree], Tree]) -
         result: What to produce when the pattern matches
 
     Returns:
-        List of two rules covering both orders
+        List holding the rule that covers both orders
 
     Example:
-        commutative('+', 0, lambda x: x)  # Creates rules for 0+x and x+0 => x
+        commutative('+', 0, lambda x: x)  # Creates a rule for 0+x and x+0 => x
+    """
+    return [_SameShape(when(op, value, _).then(result), when(op, _, value).then(result))]
+
+
+class _SameShape:
+    """first() over when() rules sharing one head and arity.
+
+    Unlike a plain first() closure, it carries that head and arity, so
+    dispatch() can still bucket it instead of trying it on every tree.
     """
-    return [when(op, value, _).then(result), when(op, _, value).then(result)]
+
+    __slots__ = ("_rules", "arity", "head")
+
+    def __init__(self, *rules: when) -> None:
+        self.head: Any = rules[0].head
+        self.arity: int = rules[0].arity
+        self._rules: Tuple[when, ...] = rules
+
+    def __call__(self, tree: Tree) -> Tree:
+        for rule in self._rules:
+            result = rule(tree)
+            if result is not tree and result != tree:
+                return result
+        return tree
 
 
 # Type matching helper
@@ -275,7 +444,7 @@ def first(*rules: Rule) -> Rule:
     def combined(tree: Tree) -> Tree:
         for rule in rules:
             result = rule(tree)
-            if result != tree:
+            if result is not tree and result != tree:
                 return result
         return tree
 
@@ -302,3 +471,157 @@ def all(*rules: Rule) -> Rule:
     return combined
 
 
+def memoize(rule: Rule) -> Rule:
+    """Cache a rule's result for each tree it has already been applied to.
+
+    Trees are immutable, so a rule that is a pure function of its input can
+    safely reuse the answer it gave last time. Wrapping the per-node rule,
+    as in bottom_up(memoize(rule)), skips re-matching the subtrees that are
+    unchanged between passes of rewrite(), since bottom_up() keeps their
+    identity. Results are cached per tree object, not per value: an equal
+    copy is computed afresh, but no lookup hashes a whole subtree, and
+    equal trees with different atom types (1 and 1.0) never share a result.
+
+    The cache is never evicted: every input and result tree is kept alive
+    for as long as the returned rule is.
+
+    Args:
+        rule: A rule with no side effects
+
+    Returns:
+        A rule that gives the same results, computing each one only once
+    """
+    # Keyed by id(); each entry holds its tree, so the id cannot be reused
+    cache: Dict[int, Tuple[Tree, Tree]] = {}
+
+    def cached(tree: Tree) -> Tree:
+        entry = cache.get(id(tree))
+        if entry is None:
+            entry = cache[id(tree)] = (tree, rule(tree))
+        return entry[1]
+
+    return cached
+
+
+def dispatch(*rules: Rule) -> Rule:
+    """Like first(), but only try rules whose pattern shape fits the tree.
+
+    Rules are bucketed once by the literal head and the arity of their
+    when() pattern (('+', 2) for when('+', 0, _)). At each tree a single dict
+    lookup on the tree's head and length picks the bucket, so a node is never
+    matched against rules that cannot apply to it. Patterns with a wildcard
+    head are still narrowed by arity. Only when() and commutative() rules
+    are indexed: any other callable, whatever attributes it carries, and
+    rules with an unhashable literal head are tried for every tree. Relative
+    rule order is preserved.
+
+    Args:
+        *rules: Rules to try in order
+
+    Returns:
+        A rule that applies the first successful transformation
+    """
+    keys = [_dispatch_key(rule) for rule in rules]
+    anywhere = tuple(rule for rule, (_h, arity) in zip(rules, keys) if arity is None)
+    buckets: Dict[Tuple[Any, Any], Tuple[Rule, ...]] = {}
+    for head, arity in keys:
+        if arity is None:
+            continue
+        # A literal-headed bucket also needs the wildcard-headed rules
+        for key in {(head, arity), (_, arity)}:
+            if key not in buckets:
+                buckets[key] = tuple(
+                    rule
+                    for rule, (h, a) in zip(rules, keys)
+                    if a is None or (a == key[1] and (h is _ or h == key[0]))
+                )
+
+    def combined(tree: Tree) -> Tree:
+        candidates = anywhere
+        if isinstance(tree, tuple):
+            arity = len(tree)
+            candidates = buckets.get((_, arity), anywhere)
+            if tree:
+                try:
+                    candidates = buckets.get((tree[0], arity), candidates)
+                except TypeError:  # unhashable head
+                    pass
+        for rule in candidates:
+            result = rule(tree)
+            if result is not tree and result != tree:
+                return result
+        return tree
+
+    return combined
+
+
+def _dispatch_key(rule: Rule) -> Tuple[Any, Optional[int]]:
+    """Return the (head, arity) a rule is bucketed under by dispatch().
+
+    Only when() rules and commutative() rules are indexed. Any other
+    callable, or a rule whose literal head is unhashable, gets arity None
+    and is tried for every tree.
+    """
+    if not isinstance(rule, (when, _SameShape)):
+        return _, None
+    head, arity = rule.head, rule.arity
+    try:
+        hash(head)
+    except TypeError:
+        return _, None
+    return head, arity
+
+
+def innermost(rule: Rule) -> Rule:
+    """Rewrite a tree to a fixed point in a single bottom-up sweep.
+
+    rewrite(tree, bottom_up(rule)) re-traverses the whole tree after every
+    change. innermost(rule) instead tracks which subtrees are already known
+    to be in normal form: children are normalized once, and when the rule
+    fires at a node only its output is revisited, skipping any parts of it
+    that are already normal. The result is a fixed point of the rule at
+    every node, so rewrite() needs just one confirming pass.
+
+    Args:
+        rule: The rule to apply at each node
+
+    Returns:
+        A rule that rewrites a whole tree to normal form
+    """
+    def normalize(tree: Tree) -> Tree:
+        # Trees known to be in normal form, by id (the value keeps them alive)
+        normal: Dict[int, Tree] = {}
+        # Explicit stack as in bottom_up(), so deep trees cannot exceed the
+        # recursion limit. Each visit leaves its normal form on `done`.
+        stack: List[Any] = [tree]
+        done: List[Tree] = []
+        while stack:
+            node = stack.pop()
+            if node is not _CHILDREN_DONE:
+                if id(node) in normal and normal[id(node)] is node:
+                    done.append(node)
+                    continue
+                # Normalize the children first, leftmost on top
+                stack.append(node)
+                stack.append(_CHILDREN_DONE)
+                if isinstance(node, tuple):
+                    stack.extend(node[:0:-1])
+                continue
+            node = stack.pop()
+            if isinstance(node, tuple) and node:
+                split = len(done) - (len(node) - 1)
+                children = tuple(done[split:])
+                del done[split:]
+                # Only rebuild the node if some child actually changed
+                if any(new is not old for new, old in zip(children, node[1:])):
+                    node = (node[0],) + children
+            new_node = rule(node)
+            if new_node is node or new_node == node:
+                normal[id(node)] = node
+                done.append(node)
+            else:
+                # Its normal form is that of the rule's output: visit that
+                stack.append(new_node)
+        return done[0]
+
+    return normalize
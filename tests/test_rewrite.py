@@ -1,13 +1,21 @@
+import sys
+
+import pytest
+
 from tree_rewriter import (
     rewrite,
     when,
     _,
     bottom_up,
+    innermost,
     commutative,
+    intern,
     is_type,
     is_literal,
     first,
     all,
+    memoize,
+    dispatch,
 )
 
 
@@ -17,6 +25,29 @@ def test_commutative_add_zero():
     assert rewrite(('+', 'x', 0), *rules) == 'x'
 
 
+def test_commutative_fuses_both_orders_into_one_rule():
+    [rule] = commutative('+', 0, lambda x: x)
+    assert rule(('+', 0, 'x')) == 'x'
+    assert rule(('+', 'y', 0)) == 'y'
+    assert rule(('*', 0, 'x')) == ('*', 0, 'x')
+
+
+def test_dispatch_indexes_commutative_rules_by_head():
+    checked = []
+
+    def is_zero(x):
+        checked.append(x)
+        return x == 0
+
+    [add_zero] = commutative('+', is_zero, lambda a, b: ('sum', a, b))
+    assert add_zero.head == '+' and add_zero.arity == 3
+    rule = dispatch(add_zero)
+    assert rule(('*', 0, 'x')) == ('*', 0, 'x')
+    assert rule(('f', 'x')) == ('f', 'x')
+    assert checked == []
+    assert rule(('+', 'x', 0)) == ('sum', 'x', 0)
+
+
 def test_bottom_up_recursive_simplification():
     # Simplify nested additions with zero to the inner variable
     rule = bottom_up(when('+', 0, _).then(lambda x: x))
@@ -24,6 +55,32 @@ def test_bottom_up_recursive_simplification():
     assert rewrite(expr, rule) == 'x'
 
 
+def test_rewrite_treats_equal_copy_as_fixed_point():
+    # A rule that rebuilds an equal tree must not loop forever
+    rule = when('f', _).then(lambda x: ('f', x))
+    expr = ('f', 'y')
+    assert rule(expr) is not expr
+    assert rewrite(expr, rule) == expr
+    assert rewrite(expr, first(rule), dispatch(rule)) == expr
+
+
+def test_bottom_up_shares_unchanged_subtrees():
+    rule = bottom_up(when('+', 0, _).then(lambda x: x))
+    expr = ('*', ('f', 'y'), ('+', 0, 'x'))
+    result = rule(expr)
+    assert result == ('*', ('f', 'y'), 'x')
+    assert result[1] is expr[1]
+    assert rule(expr[1]) is expr[1]
+
+
+def test_bottom_up_handles_trees_deeper_than_recursion_limit():
+    expr = 'x'
+    for _i in range(sys.getrecursionlimit() + 100):
+        expr = ('+', 0, expr)
+    rule = bottom_up(when('+', 0, _).then(lambda x: x))
+    assert rule(expr) == 'x'
+
+
 def test_first_and_all_combinators():
     r_inc = when('n', is_type(int)).then(lambda n: ('n', n + 1))
     r_double = when('n', is_type(int)).then(lambda n: ('n', n * 2))
@@ -107,6 +164,14 @@ def test_when_without_then_is_noop():
     assert rewrite(('tag', 1), rule) == ('tag', 1)
 
 
+def test_when_pattern_is_read_only():
+    rule = when('f', 1).then('x')
+    assert rule.pattern == ('f', 1)
+    with pytest.raises(AttributeError):
+        rule.pattern = ('g', 1)
+    assert rule(('f', 1)) == 'x'
+
+
 def test_tuple_arity_mismatch_does_not_match():
     # Pattern ('+', _, _) should not match a unary '+'
     rule = when('+', _, _).then(0)
@@ -154,3 +219,151 @@ def test_rule_with_multiple_wildcards():
     tree = ('op', 1, 'keep', 2)
     result = swap_ends(tree)
     assert result == ('op', 2, 'keep', 1)
+
+
+def test_intern_shares_equal_subtrees():
+    a = intern(('+', ('*', 2, 'x'), ('*', 2, 'x')))
+    b = intern(('*', 2, 'x'))
+    assert a == ('+', ('*', 2, 'x'), ('*', 2, 'x'))
+    assert a[1] is a[2] is b
+    assert intern('x') == 'x'
+    sin = 'sin'
+    assert intern(''.join(['si', 'n'])) is sin
+
+
+def test_intern_keeps_atom_types_apart():
+    assert intern(('n', 1)) == ('n', 1)
+    assert type(intern(('n', 1.0))[1]) is float
+    assert type(intern(('f', ('n', 1.0)))[1][1]) is float
+    intern(('and', True, 'x'))
+    assert intern(('and', 1, 'x'))[1] is not True
+
+
+def test_intern_keeps_signed_zeros_apart():
+    intern(('n', 0.0))
+    assert str(intern(('n', -0.0))[1]) == '-0.0'
+
+
+def test_intern_handles_trees_deeper_than_recursion_limit():
+    expr = 'x'
+    for _i in range(sys.getrecursionlimit() + 100):
+        expr = ('+', 0, expr)
+    result = intern(expr)
+    assert intern(expr) is result
+    while result != 'x':
+        assert result[:2] == ('+', 0)
+        result = result[2]
+
+
+def test_intern_accepts_str_subclasses():
+    class Sym(str):
+        pass
+
+    x = Sym('x')
+    assert intern(x) is x
+    assert intern(('f', x))[1] is x
+
+
+def test_memoize_reuses_results():
+    calls = []
+
+    def double(tree):
+        calls.append(tree)
+        return ('n', tree[1] * 2) if tree[0] == 'n' else tree
+
+    rule = memoize(double)
+    tree = ('n', 3)
+    assert rule(tree) == ('n', 6)
+    assert rule(tree) == ('n', 6)
+    assert calls == [('n', 3)]
+    # Unhashable trees are cached too
+    tree = ('m', [1])
+    assert rule(tree) == ('m', [1])
+    assert rule(tree) == ('m', [1])
+    assert len(calls) == 2
+
+
+def test_memoize_keeps_atom_types_apart():
+    rule = memoize(when('+', is_literal, is_literal).then(lambda a, b: a + b))
+    assert rule(('+', 1, 2)) == 3
+    result = rule(('+', 1.0, 2.0))
+    assert result == 3.0 and type(result) is float
+
+
+def test_dispatch_only_tries_rules_for_tree_head():
+    tried = []
+
+    def spy(tree):
+        tried.append(tree)
+        return tree
+
+    add_zero = when('+', _, 0).then(lambda x: x)
+    mul_zero = when('*', _, 0).then(0)
+    rule = dispatch(add_zero, mul_zero, spy)
+    assert add_zero.head == '+' and when('$op', _).head is _
+    assert rule(('*', 'x', 0)) == 0
+    assert rule(('+', 'x', 0)) == 'x'
+    assert rule(('-', 'x', 0)) == ('-', 'x', 0)
+    assert tried == [('-', 'x', 0)]
+    assert rewrite(('+', ('*', 'y', 0), 0), bottom_up(rule)) == 0
+
+
+def test_dispatch_narrows_by_arity():
+    heads = []
+
+    def unary_head(op):
+        heads.append(op)
+        return op in ('neg', 'sin')
+
+    negate = when(unary_head, '$x').then(lambda op, x: x)
+    double_neg = when('neg', ('neg', '$x')).then(lambda x: x)
+    rule = dispatch(double_neg, negate)
+    assert negate.arity == 2 and when('+', _, 0).arity == 3
+    assert rule(('neg', ('neg', 'y'))) == 'y'
+    assert rule(('+', 'x', 0)) == ('+', 'x', 0)
+    assert rule(('sin', 'x')) == 'x'
+    assert heads == ['sin']
+
+
+def test_dispatch_tries_plain_functions_on_every_tree():
+    def wrap(tree):
+        return ('seen', tree) if tree == 'x' else tree
+
+    wrap.head, wrap.arity = '+', 3
+    assert dispatch(wrap)('x') == ('seen', 'x')
+
+
+def test_dispatch_accepts_unhashable_literal_head():
+    rule = dispatch(when(['a'], _).then('list'), when('+', _, 0).then(lambda x: x))
+    assert rule((['a'], 'x')) == 'list'
+    assert rule(('+', 'y', 0)) == 'y'
+    assert rule(('f', 'x')) == ('f', 'x')
+
+
+def test_innermost_reaches_fixed_point_in_one_call():
+    # x * 2 => x + x, then x + 0 => x; outputs must be revisited to finish
+    rules = first(
+        when('*', _, 2).then(lambda x: ('+', x, x)),
+        when('+', _, 0).then(lambda x: x),
+        when('+', 0, _).then(lambda x: x),
+    )
+    expr = ('*', ('+', 0, ('+', 'y', 0)), 2)
+    assert innermost(rules)(expr) == ('+', 'y', 'y')
+    assert rewrite(expr, innermost(rules)) == rewrite(expr, bottom_up(rules))
+
+
+def test_innermost_shares_unchanged_subtrees():
+    rule = innermost(when('+', 0, _).then(lambda x: x))
+    expr = ('*', ('f', 'y'), ('+', 0, 'x'))
+    result = rule(expr)
+    assert result == ('*', ('f', 'y'), 'x')
+    assert result[1] is expr[1]
+    assert rule(expr[1]) is expr[1]
+
+
+def test_innermost_handles_trees_deeper_than_recursion_limit():
+    expr = 'x'
+    for _i in range(sys.getrecursionlimit() + 100):
+        expr = ('+', 0, expr)
+    rule = innermost(when('+', 0, _).then(lambda x: x))
+    assert rule(expr) == 'x'